@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import functools
+import tjson
+import pytest
+
+
+def encode_error(expected_msg, exc_cls=tjson.EncodeError):
+    def wrapper(fn):
+        @functools.wraps(fn)
+        def inner(*a, **kw):
+            with pytest.raises(exc_cls) as exc_info:
+                fn(*a, **kw)
+            assert str(exc_info.value) == expected_msg
+        return inner
+    return wrapper
+
+
+class Text(type(u'')):
+    pass
+
+
+class Binary(bytes):
+    pass
+
+
+class Int(int):
+    def __str__(self):
+        return 'not a number'
+
+
+def test_empty_array():
+    assert tjson.dumps([]) == '[]'
+
+
+def test_utf8_string():
+    assert tjson.dumps([u'hello, world!']) == '["s:hello, world!"]'
+
+
+def test_binary_data():
+    assert tjson.dumps([b'Hello, world!']) == '["b64:SGVsbG8sIHdvcmxkIQ"]'
+
+
+def test_float():
+    assert tjson.dumps([42.5]) == '[42.5]'
+
+
+def test_integers():
+    assert tjson.dumps([-1, 0, 42]) == '["i:-1", "u:0", "u:42"]'
+
+
+def test_booleans():
+    assert tjson.dumps([True, False]) == '["u:1", "u:0"]'
+
+
+def test_int_subclass():
+    assert tjson.dumps([Int(42), Int(-42)]) == '["u:42", "i:-42"]'
+
+
+def test_int_enum():
+    enum = pytest.importorskip('enum')
+
+    class Color(enum.IntEnum):
+        red = 3
+        blue = -2
+
+    assert tjson.dumps([Color.red, Color.blue]) == '["u:3", "i:-2"]'
+
+
+def test_text_and_binary_subclasses():
+    assert tjson.dumps([Text(u'foo'), Binary(b'foo')]) == (
+        '["s:foo", "b64:Zm9v"]')
+
+
+def test_text_subclass_member_name():
+    assert tjson.dumps({Text(u'foo'): Text(u'bar')}) == '{"s:foo": "s:bar"}'
+
+
+def test_binary_subclass_member_name():
+    assert tjson.dumps({Binary(b'foo'): 1}) == '{"b64:Zm9v": "u:1"}'
+
+
+@encode_error('Object member names must be text or binary')
+def test_invalid_integer_member_name():
+    tjson.dumps({42: u'foo'})
+
+
+def test_member_order():
+    # Containers and subclasses are packed after their siblings, into slots
+    # reserved in the original order
+    obj = OrderedDict([(u'a', [1]), (u'b', 2), (u'c', {u'd': 3}),
+                       (u'e', Text(u'f')), (u'g', 4.5)])
+    assert tjson.dumps(obj) == ('{"s:a": ["u:1"], "s:b": "u:2", '
+                                '"s:c": {"s:d": "u:3"}, "s:e": "s:f", '
+                                '"s:g": 4.5}')
+
+
+def test_repeated_container():
+    shared = [1]
+    assert tjson.dumps([shared, {u'a': shared}]) == (
+        '[["u:1"], {"s:a": ["u:1"]}]')
+
+
+@encode_error('Circular reference detected')
+def test_circular_object():
+    obj = {}
+    obj[u'x'] = obj
+    tjson.dumps(obj)
+
+
+@encode_error('Circular reference detected')
+def test_circular_array():
+    obj = [1.5]
+    obj.append([obj])
+    tjson.dumps(obj)
@@ -33,6 +33,30 @@ def test_object_with_binary_data_key():
     }
 
 
+def test_array_in_array():
+    assert tjson.loads('[["s:a", ["u:1"]], "s:b"]') == [[u'a', [1]], u'b']
+
+
+def test_object_in_array():
+    assert tjson.loads('[{"s:a":"s:b"}, {"s:c":{"s:d":"i:-1"}}]') == [
+        {u'a': u'b'},
+        {u'c': {u'd': -1}},
+    ]
+
+
+def test_array_in_object():
+    assert tjson.loads('{"s:x":["u:1", [2]],"s:y":"s:z"}') == {
+        u'x': [1, [2.0]],
+        u'y': u'z',
+    }
+
+
+def test_unpack_copies():
+    obj = {u's:a': [u's:b', {u'b16:00': 1}]}
+    assert tjson.unpack(obj) == {u'a': [u'b', {b'\x00': 1.0}]}
+    assert obj == {u's:a': [u's:b', {u'b16:00': 1}]}
+
+
 @parse_error("Invalid tag (missing ':' delimeter)")
 def test_invalid_object_with_bare_string_key():
     tjson.loads('{"foo":"s:bar"}')
@@ -61,6 +85,13 @@ def test_utf8_and_binary_keys():
                                    'Duplicate key: %r' % b'foo')
 
 
+@parse_error("Invalid tag (missing ':' delimeter)")
+def test_member_names_checked_before_values():
+    # Member names are parsed while the JSON is decoded, so a bad name is
+    # reported even when an earlier value is also invalid
+    tjson.loads('["t:2016-13-02T07:31:51Z", {"x": 1}]')
+
+
 @parse_error('Toplevel elements other than object or array are disallowed')
 def test_bare_string():
     tjson.loads('"s:hello, world!"')
@@ -116,6 +147,16 @@ def test_base32_binary_data():
     assert tjson.loads('["b32:jbswy3dpfqqho33snrscc"]') == [b'Hello, world!']
 
 
+def test_base32_binary_data_lengths():
+    data = '["b32:my", "b32:mzxq", "b32:mzxw6", "b32:mzxw6yq", "b32:mzxw6ytb"]'
+    assert tjson.loads(data) == [b'f', b'fo', b'foo', b'foob', b'fooba']
+
+
+@parse_error('Invalid base32-encoded data')
+def test_invalid_base32_binary_data_length():
+    tjson.loads('["b32:mzx"]')
+
+
 @parse_error('Base32 data must be lowercase')
 def test_invalid_base32_binary_data_with_bad_case():
     tjson.loads('["b32:JBSWY3DPFQQHO33SNRSCC"]')
@@ -159,12 +200,28 @@ def test_invalid_base64url_binary_data():
     tjson.loads('["b64:This is not a valid base64url string"]')
 
 
+@parse_error('Invalid base64-encoded data')
+def test_invalid_base64url_binary_data_length():
+    tjson.loads('["b64:R07BCzE75yulP"]')
+
+
+@parse_error('Invalid base64-encoded data')
+def test_invalid_base64url_binary_data_with_non_ascii_characters():
+    tjson.loads(u'["b64:SGVsbG8sIHdvcmxkIQ\u00e9"]')
+
+
 def test_int_as_float():
     value = tjson.loads('[42]')
     assert value == [42.0]
     assert type(value[0]) == float
 
 
+def test_negative_zero_int_as_float():
+    value = tjson.loads('[-0, -0.0]')
+    assert str(value[0]) == '0.0'
+    assert str(value[1]) == '-0.0'
+
+
 def test_float():
     assert tjson.loads('[42.5]') == [42.5]
 
@@ -1,8 +1,8 @@
 import base64
 import binascii
+from collections import OrderedDict
 from datetime import datetime, timedelta, tzinfo
 import json
-import re
 
 
 __all__ = ['EncodeError', 'ParseError', 'loads', 'dumps']
@@ -12,9 +12,31 @@ __version__ = '0.1.0'
 INT_MAX = 2 ** 63 - 1
 INT_MIN = -(2 ** 63)
 UINT_MAX = 2 ** 64 - 1
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
 text_type = type(u'')
 
+# Translation table that deletes the uppercase letters base32 forbids, so a
+# length change after translate() means one was present.
+_B32_UPPERCASE = dict.fromkeys(map(ord, u'ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+
+# Base32 is decoded by reading it as one big base-32 number with int(). The
+# first table deletes the alphabet, leaving any characters that don't
+# belong; the second maps each digit onto the one int() uses for its value.
+_B32_ALPHABET = u'abcdefghijklmnopqrstuvwxyz234567'
+_B32_INVALID = dict.fromkeys(map(ord, _B32_ALPHABET))
+_B32_TO_INT_DIGITS = dict(zip(map(ord, _B32_ALPHABET),
+                              u'0123456789abcdefghijklmnopqrstuv'))
+
+# bytes.translate() table mapping the base64url alphabet onto standard base64
+_B64URL_TO_B64 = bytearray(range(256))
+_B64URL_TO_B64[ord('-')] = ord('+')
+_B64URL_TO_B64[ord('_')] = ord('/')
+_B64URL_TO_B64 = bytes(_B64URL_TO_B64)
+
+# Padding to append to unpadded base64, indexed by length modulo 4
+_B64_PADDING = (b'', b'===', b'==', b'=')
+
 
 class EncodeError(ValueError):
     """Exception class when trying to encode bad data."""
@@ -31,21 +53,46 @@ def want_bytes(data):
 
 
 def raise_on_duplicate_keys(pairs):
-    d = {}
-    for k, v in pairs:
-        if k in d:
-            raise ParseError("Duplicate key: '%s'" % k)
-        d[k] = v
+    d = dict(pairs)
+    if len(d) != len(pairs):
+        # Only walk the pairs to find which key was repeated
+        seen = set()
+        for k, v in pairs:
+            if k in seen:
+                raise ParseError("Duplicate key: '%s'" % k)
+            seen.add(k)
     return d
 
 
+def unpack_pairs(pairs):
+    """Build an object from JSON member pairs, parsing the member names."""
+    rv = {}
+    binary_keys = set()
+    for k, v in raise_on_duplicate_keys(pairs).items():
+        parsed_key = parse_str(k)
+        # parse_str() never returns subclasses, so compare types
+        kt = type(parsed_key)
+        if kt is not text_type and kt is not bytes:
+            raise ParseError('Object member names must be text or binary')
+        # Seeing whether the set grew takes one want_bytes() and one hash,
+        # instead of two of each for a lookup followed by an insert
+        size = len(binary_keys)
+        binary_keys.add(want_bytes(parsed_key))
+        if len(binary_keys) == size:
+            raise ParseError('Duplicate key: %r' % parsed_key)
+        rv[parsed_key] = v
+    return rv
+
+
 def loads(s, **kwargs):
-    kwargs['object_pairs_hook'] = raise_on_duplicate_keys
+    # Member names are handled as each object is decoded, which leaves
+    # _unpack_values() to fix up the values of the finished tree in place
+    kwargs['object_pairs_hook'] = unpack_pairs
     obj = json.loads(s, **kwargs)
     if not isinstance(obj, (list, dict)):
         raise ParseError('Toplevel elements other than object or array are '
                          'disallowed')
-    return unpack(obj)
+    return _unpack_values(obj)
 
 
 def dumps(obj):
@@ -56,123 +103,233 @@ def dumps(obj):
 
 
 def pack(obj):
-    if isinstance(obj, list):
-        return [pack(e) for e in obj]
-    elif isinstance(obj, dict):
-        rv = {}
-        for k in obj:
-            if not isinstance(k, (text_type, bytes)):
-                raise EncodeError('Object member names must be text or binary')
-            rv[pack(k)] = pack(obj[k])
-        return rv
-    elif isinstance(obj, text_type):
-        return u's:' + obj
-    elif isinstance(obj, bytes):
-        return u'b64:' + (base64.urlsafe_b64encode(obj).rstrip(b'=')
-                          .decode('ascii'))
-    elif isinstance(obj, float):
-        return obj
-    elif isinstance(obj, int):
-        if obj < 0:
-            return u'i:%d' % obj
+    # Walk the tree with an explicit stack rather than recursing, to save a
+    # function call per node. Each item is a container slot to fill, plus
+    # the value to be packed into it.
+    root = [None]
+    stack = [(root, 0, obj)]
+    # ids of the containers on the path to the current one
+    active = set()
+    while stack:
+        parent, key, obj = stack.pop()
+        if parent is None:
+            # Exit marker for the container whose id is in key
+            active.remove(key)
+            continue
+
+        packer = _PACKERS.get(type(obj))
+        if packer is not None:
+            rv = packer(obj)
+        elif isinstance(obj, list):
+            _enter_container(obj, active, stack)
+            rv = [None] * len(obj)
+            for i, e in enumerate(obj):
+                # Fill exact scalars straight into the preallocated list, so
+                # only containers and subclasses go through the stack
+                packer = _PACKERS.get(type(e))
+                if packer is not None:
+                    rv[i] = packer(e)
+                else:
+                    stack.append((rv, i, e))
+        elif isinstance(obj, dict):
+            _enter_container(obj, active, stack)
+            # Keep an ordered input ordered on Pythons where dicts aren't
+            rv = OrderedDict() if isinstance(obj, OrderedDict) else {}
+            for k in obj:
+                kt = type(k)
+                if kt is text_type:
+                    packed_key = _pack_text(k)
+                elif kt is bytes:
+                    packed_key = _pack_bytes(k)
+                elif isinstance(k, (text_type, bytes)):
+                    packed_key = _pack_subclass(k)
+                else:
+                    raise EncodeError('Object member names must be text or '
+                                      'binary')
+                v = obj[k]
+                packer = _PACKERS.get(type(v))
+                if packer is not None:
+                    rv[packed_key] = packer(v)
+                else:
+                    # Reserve the slot now to keep the member order
+                    rv[packed_key] = None
+                    stack.append((rv, packed_key, v))
         else:
-            return u'u:%d' % obj
+            rv = _pack_subclass(obj)
+        parent[key] = rv
+    return root[0]
+
+
+def _enter_container(obj, active, stack):
+    if id(obj) in active:
+        raise EncodeError('Circular reference detected')
+    active.add(id(obj))
+    # The exit marker goes below the children, so it comes off the stack
+    # once they have all been packed
+    stack.append((None, id(obj), None))
+
+
+def _pack_text(obj):
+    return u's:' + obj
+
+
+def _pack_bytes(obj):
+    return u'b64:' + (base64.urlsafe_b64encode(obj).rstrip(b'=')
+                      .decode('ascii'))
+
+
+def _pack_float(obj):
+    return obj
+
+
+def _pack_int(obj):
+    # Concatenation beats %-formatting, but only _PACKERS sends exact ints
+    # here; bools and subclasses would stringify differently
+    if obj < 0:
+        return u'i:' + str(obj)
+    else:
+        return u'u:' + str(obj)
+
+
+def _pack_int_like(obj):
+    if obj < 0:
+        return u'i:%d' % obj
+    else:
+        return u'u:%d' % obj
+
+
+def _pack_subclass(obj):
+    # _PACKERS is keyed on exact types, so subclasses end up here
+    for cls in (text_type, bytes, float):
+        if isinstance(obj, cls):
+            return _PACKERS[cls](obj)
+    if isinstance(obj, int):
+        return _pack_int_like(obj)
 
 
 def unpack(obj):
     """Deep copy of obj, parse any string values."""
+    # Wrapping obj lets _unpack_values() handle a bare scalar too
+    return _unpack_values([_copy_unpacking_names(obj)])[0]
+
+
+def _copy_unpacking_names(obj):
+    # Copy the containers of a plain JSON tree, parsing member names the way
+    # loads() does through unpack_pairs(). Values are left for
+    # _unpack_values().
     if isinstance(obj, list):
-        return [unpack(e) for e in obj]
+        return [_copy_unpacking_names(e) for e in obj]
     elif isinstance(obj, dict):
-        rv = {}
-        binary_keys = set()
-        for k in obj:
-            parsed_key = parse_str(k)
-            if not isinstance(parsed_key, (text_type, bytes)):
-                raise ParseError('Object member names must be text or binary')
-            elif want_bytes(parsed_key) in binary_keys:
-                raise ParseError('Duplicate key: %r' % parsed_key)
-            rv[parsed_key] = unpack(obj[k])
-            binary_keys.add(want_bytes(parsed_key))
-        return rv
-    elif isinstance(obj, text_type):
-        return parse_str(obj)
-    elif isinstance(obj, float):
-        return obj
-    elif isinstance(obj, int):
-        return float(obj)
-
-    raise TypeError('Unrecognized TJSON object type')
+        return unpack_pairs([(k, _copy_unpacking_names(v))
+                             for k, v in obj.items()])
+    return obj
+
+
+def _unpack_values(obj):
+    # Parse the string values of a tree whose member names unpack_pairs()
+    # has already parsed. This works in place, so loads() uses it on the
+    # tree it just decoded instead of making a copy.
+    stack = [obj]
+    while stack:
+        container = stack.pop()
+        if isinstance(container, list):
+            items = enumerate(container)
+        else:
+            items = container.items()
+        for k, v in items:
+            # json only builds exact types, so compare those first and leave
+            # isinstance() for anything a caller's parse_* hook returned
+            t = type(v)
+            if t is text_type:
+                container[k] = parse_str(v)
+            elif t is int:
+                # All TJSON numbers are floats. Converting here rather than
+                # through parse_int keeps the JSON scanner in C, and
+                # float(int('-0')) is 0.0 where float('-0') is -0.0
+                container[k] = float(v)
+            elif t is float:
+                pass
+            elif isinstance(v, (list, dict)):
+                stack.append(v)
+            elif isinstance(v, text_type):
+                container[k] = parse_str(v)
+            elif isinstance(v, float):
+                pass
+            elif isinstance(v, int):
+                container[k] = float(v)
+            else:
+                raise TypeError('Unrecognized TJSON object type')
+    return obj
 
 
 def parse_str(s):
-    try:
-        ndx = s.index(':', 0, 4)
-    except ValueError:
+    tag, sep, body = s.partition(':')
+    if not sep or len(tag) > 3:
         raise ParseError("Invalid tag (missing ':' delimeter)")
-    tag, body = s[:ndx + 1], s[ndx + 1:]
-
-    if tag == 's:':
-        return body
-    elif tag == 'b16:':
-        return _parse_b16(body)
-    elif tag == 'b32:':
-        return _parse_b32(body)
-    elif tag == 'b64:':
-        return _parse_b64(body)
-    elif tag == 'i:':
-        return _parse_int(body)
-    elif tag == 'u:':
-        return _parse_uint(body)
-    elif tag == 't:':
-        return _parse_date(body)
-
-    raise ParseError('Invalid tag %r on string %r' % (tag, s))
 
+    parser = _TAG_PARSERS.get(tag)
+    if parser is None:
+        raise ParseError('Invalid tag %r on string %r' % (tag + sep, s))
+    return parser(body)
+
+
+def _parse_s(s):
+    return s
 
-def _parse_b16(s):
-    if re.search(r'[A-F]', s):
-        raise ParseError('Base16 data must be lowercase')
 
+def _parse_b16(s):
     try:
-        return binascii.unhexlify(s)
+        rv = binascii.unhexlify(s)
     except (TypeError, ValueError):
         raise ParseError('Invalid hexadecimal data')
 
+    # unhexlify accepts either case. Single-character searches run as
+    # memchr(), which libc vectorizes, so this beats s.lower() on large data.
+    if (u'A' in s or u'B' in s or u'C' in s or u'D' in s or u'E' in s or
+            u'F' in s):
+        raise ParseError('Base16 data must be lowercase')
+    return rv
+
 
 def _parse_b32(s):
-    if re.search(r'[A-Z]', s):
+    # lower() is a cheap first test, but it also folds non-ASCII letters
+    if s != s.lower() and len(s.translate(_B32_UPPERCASE)) != len(s):
         raise ParseError('Base32 data must be lowercase')
     elif s.endswith('='):
         raise ParseError('Base32 data must not include padding')
-
-    padding = '=' * (-len(s) % 8)
-    try:
-        return base64.b32decode(s.upper() + padding)
-    except (TypeError, ValueError):
+    elif s.translate(_B32_INVALID) or len(s) % 8 in (1, 3, 6):
         raise ParseError('Invalid base32-encoded data')
+    elif not s:
+        return b''
+
+    # Drop the leftover bits of a partial final byte, as b32decode does
+    size = len(s) * 5 // 8
+    val = int(s.translate(_B32_TO_INT_DIGITS), 32) >> (len(s) * 5 % 8)
+    return binascii.unhexlify('%0*x' % (size * 2, val))
 
 
 def _parse_b64(s):
-    if re.search(r'\+|\/', s):
+    if u'+' in s or u'/' in s:
         raise ParseError("Base64 data must not contain '+' or '/'")
     elif s.endswith('='):
         raise ParseError('Base64 data must not include padding')
 
-    padding = u'=' * (-len(s) % 4)
     try:
-        encoded = want_bytes(s + padding)
-        return base64.urlsafe_b64decode(encoded)
-    except (TypeError, ValueError):
+        encoded = s.encode('ascii') + _B64_PADDING[len(s) % 4]
+        return binascii.a2b_base64(encoded.translate(_B64URL_TO_B64))
+    except (binascii.Error, TypeError, ValueError):
+        # binascii.Error is only a ValueError on Python 3
         raise ParseError('Invalid base64-encoded data')
 
 
 def _parse_int(s):
     val = int(s)
-    if val > INT_MAX:
-        raise ParseError('oversized integer: %d' % val)
-    elif val < INT_MIN:
-        raise ParseError('undersized integer: %d' % val)
+    # 18 characters can't spell anything outside the 64-bit range
+    if len(s) > 18:
+        if val > INT_MAX:
+            raise ParseError('oversized integer: %d' % val)
+        elif val < INT_MIN:
+            raise ParseError('undersized integer: %d' % val)
     return val
 
 
@@ -180,10 +337,41 @@ def _parse_uint(s):
     val = int(s)
     if val < 0:
         raise ParseError('negative value for unsigned integer: %d' % val)
-    elif val > UINT_MAX:
+    elif len(s) > 19 and val > UINT_MAX:
         raise ParseError('oversized integer: %d' % val)
     return val
 
 
 def _parse_date(s):
-    return datetime.strptime(s, '%Y-%m-%dT%H:%M:%SZ')
+    # The format is fixed-width, so slice the fields out directly rather
+    # than going through strptime. Anything unexpected is handed to strptime
+    # so the error matches what it has always raised.
+    if (len(s) == 20 and s[4] == s[7] == '-' and s[10] == 'T' and
+            s[13] == s[16] == ':' and s[19] == 'Z' and
+            (s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] +
+             s[17:19]).isdigit()):
+        try:
+            return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                            int(s[11:13]), int(s[14:16]), int(s[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(s, DATE_FORMAT)
+
+
+_TAG_PARSERS = {
+    's': _parse_s,
+    'b16': _parse_b16,
+    'b32': _parse_b32,
+    'b64': _parse_b64,
+    'i': _parse_int,
+    'u': _parse_uint,
+    't': _parse_date,
+}
+
+_PACKERS = {
+    text_type: _pack_text,
+    bytes: _pack_bytes,
+    float: _pack_float,
+    int: _pack_int,
+    bool: _pack_int_like,
+}